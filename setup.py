@@ -26,7 +26,6 @@ setuptools.setup(
         "black >= 24.1.0",
         "com2ann >= 0.3.0",
         "libcst >= 1.1.0",
-        "pyupgrade >= 3.15.0",
         "ruff",
     ],
     python_requires=">=3.8",
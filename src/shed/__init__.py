@@ -5,14 +5,18 @@ pass the names of specific files to format instead.
 """
 
 import functools
+import hashlib
 import os
 import re
+import shutil
 import subprocess
 import sys
+import tempfile
 import textwrap
 import warnings
 from operator import attrgetter
-from typing import Any, FrozenSet, Match, Tuple
+from pathlib import Path
+from typing import Any, FrozenSet, Match, Optional, Tuple
 
 import black
 from black.mode import TargetVersion
@@ -31,10 +35,44 @@ _version_map = {
     if k.value >= TargetVersion.PY38.value
 }
 _default_min_version = min(_version_map.values())
+# Precomputed lookups so `_detect_versions` doesn't rebuild them per call:
+# the candidate TargetVersions for each minimum version, and all versions
+# in ascending order for finding the oldest detected one.
+_targets_for_min = {
+    v: frozenset(k for k, kv in _version_map.items() if kv >= v)
+    for v in _version_map.values()
+}
+_targets_ascending = tuple(sorted(_version_map, key=attrgetter("value")))
+# Compiled once at import time; `docshed()` used to rebuild these per call,
+# which also meant re-running the regex compiler whenever its lru_cache missed.
+_markdown_pattern = re.compile(
+    r"(?P<before>^(?P<indent> *)```python\n)"
+    r"(?P<code>.*?)"
+    r"(?P<after>^(?P=indent)```\s*$)",
+    flags=re.DOTALL | re.MULTILINE,
+)
+_rst_pattern = re.compile(
+    r"(?P<before>"
+    r"^(?P<indent> *)\.\. "
+    r"(?P<block>jupyter-execute::|"
+    r"invisible-code-block: python|"  # magic rst comment for Sybil doctests
+    r"(code|code-block|sourcecode|ipython):: (python|py|sage|python3|py3|numpy))\n"
+    r"((?P=indent) +:.*\n)*"
+    r"\n*"
+    r")"
+    r"(?P<code>(^((?P=indent) +.*)?\n)+)",
+    flags=re.MULTILINE,
+)
+# Used by `_rst_match` for every matched block, so also compiled just once.
+_indent_pattern = re.compile("^ +(?=[^ ])", re.MULTILINE)
+_trailing_newline_pattern = re.compile(r"\n+\Z", re.MULTILINE)
 _SUGGESTIONS = (
     # If we fail on invalid syntax, check for detectable wrong-codeblock types
-    (r"^(>>> | ?In \[\d+\]: )", "pycon"),
-    (r"^Traceback \(most recent call last\):$", "python-traceback"),
+    (re.compile(r"^(>>> | ?In \[\d+\]: )", flags=re.MULTILINE), "pycon"),
+    (
+        re.compile(r"^Traceback \(most recent call last\):$", flags=re.MULTILINE),
+        "python-traceback",
+    ),
 )
 
 _RUFF_RULES = (
@@ -132,6 +170,146 @@ class ShedSyntaxWarning(SyntaxWarning):
 
 
 @functools.lru_cache
+def _cache_dir() -> Optional[Path]:
+    """Return a persistent cache directory, keyed by our tool versions.
+
+    The in-process `lru_cache` on `shed()` dies with each CLI invocation, so
+    re-running on a mostly-unchanged tree - the dominant CI and pre-commit
+    workload - used to repeat all the parsing and formatting work.  Caching
+    results on disk makes those runs near-free.  Keying the directory name by
+    the versions of every tool that affects output means that upgrading any
+    of them naturally invalidates the whole cache.
+    """
+    try:
+        from importlib.metadata import version
+
+        # The interpreter version matters too: com2ann output depends on
+        # min(min_version, sys.version_info), so venvs on different Pythons
+        # sharing one $HOME must not share cache entries.
+        versions = "-".join(
+            [f"py3{sys.version_info[1]}", __version__]
+            + [version(dist) for dist in ("black", "com2ann", "libcst", "ruff")]
+        )
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        cache_dir = Path(base) / "shed" / versions
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except Exception:  # pragma: no cover  # e.g. read-only home directory
+        return None
+    _prune_cache(cache_dir)
+    return cache_dir
+
+
+def _prune_cache(cache_dir: Path, max_entries: int = 8192) -> None:
+    """Keep the persistent cache from growing without bound.
+
+    Superseded version directories - left behind when any of our tools is
+    upgraded - are removed outright, and once the current directory grows
+    past `max_entries` files the oldest half are aged out.  This runs once
+    per process, from `_cache_dir`.
+    """
+    try:
+        for sibling in cache_dir.parent.iterdir():
+            if sibling != cache_dir:
+                shutil.rmtree(sibling, ignore_errors=True)
+        entries = [(e.stat().st_mtime_ns, e.path) for e in os.scandir(cache_dir)]
+        if len(entries) > max_entries:
+            entries.sort()
+            for _, stale in entries[: len(entries) - max_entries // 2]:
+                os.unlink(stale)
+    except OSError:  # pragma: no cover  # a cache failure should never be fatal
+        pass
+
+
+def _cache_store(cache_path: Path, result: str) -> None:
+    """Atomically write a formatted result into the persistent cache."""
+    try:
+        fd, tmpname = tempfile.mkstemp(dir=cache_path.parent)
+    except OSError:  # pragma: no cover  # a cache failure should never be fatal
+        return
+    try:
+        with open(fd, mode="w", encoding="utf-8") as handle:
+            handle.write(result)
+        os.replace(tmpname, cache_path)
+    except OSError:  # pragma: no cover  # don't leave tempfiles behind either
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+
+
+@functools.lru_cache(maxsize=512)
+def _detect_versions(
+    source_code: str, min_version: Tuple[int, int]
+) -> Tuple[FrozenSet[TargetVersion], Tuple[int, int]]:
+    """Parse the source once to detect the black target versions.
+
+    This is the most expensive single step per file, and the lru_cache on
+    `shed()` itself keys on options like `_location` which don't affect
+    parsing - so identical sources seen under different options would
+    otherwise be re-parsed here.
+    """
+    candidates = _targets_for_min[min_version]
+    parsed = lib2to3_parse(source_code.lstrip(), candidates)
+    # black.InvalidInput, blib2to3.pgen2.tokenize.TokenError, SyntaxError...
+    # may all be raised here; handled (and not cached) in the caller.
+    if len(candidates) == 1:
+        # Feature detection can only narrow the candidate set, so with a
+        # single candidate there is nothing to detect.  The parse above still
+        # runs because it doubles as our syntax validation.
+        return candidates, min_version
+    target_versions = candidates & set(black.detect_target_versions(parsed))
+    assert target_versions
+    # The assert above means this lookup always finds at least one version.
+    oldest = [k for k in _targets_ascending if k in target_versions][0]
+    min_version = max(min_version, _version_map[oldest])
+    return target_versions, min_version
+
+
+@functools.lru_cache(maxsize=32)
+def _black_mode(target_versions: FrozenSet[TargetVersion], is_pyi: bool) -> black.Mode:
+    """Share one black.Mode per (target_versions, is_pyi) combination.
+
+    `format_str` never mutates its mode, and most runs see only a handful of
+    distinct combinations, so there's no point rebuilding the dataclass (and
+    re-validating its fields) for every file.
+    """
+    # black.Mode insists on a mutable set, so copy out of the cached frozenset
+    return black.Mode(target_versions=set(target_versions), is_pyi=is_pyi)
+
+
+@functools.lru_cache(maxsize=64)
+def _ruff_argv(
+    min_version: Tuple[int, int],
+    first_party_imports: FrozenSet[str],
+    remove_unused_imports: bool,
+) -> Tuple[str, ...]:
+    """Build the ruff command line for these options, once per combination.
+
+    Every element is a pure function of the arguments, so there's no reason
+    to rebuild the rule selection and config strings for each file.
+    """
+    select = ",".join(_RUFF_RULES)
+    if remove_unused_imports:
+        select += ",F401"
+    return (
+        "ruff",
+        "check",
+        f"--select={select}",
+        "--fix-only",
+        f"--target-version=py3{min_version[1]}",
+        "--isolated",  # ignore configuration files
+        "--exit-zero",  # Exit with 0, even upon detecting lint violations.
+        "--config=lint.isort.combine-as-imports=true",
+        f"--config=lint.isort.known-first-party={sorted(first_party_imports)}",
+        f"--config=lint.extend-safe-fixes={list(_RUFF_EXTEND_SAFE_FIXES)}",
+        "-",  # pass code on stdin
+    )
+
+
+# The in-process caches are bounded because they retain both the source and
+# the result string per entry, which adds up to tens of MB on a large repo
+# run; anything evicted here is still served cheaply by the on-disk cache.
+@functools.lru_cache(maxsize=128)
 def shed(
     source_code: str,
     *,
@@ -146,24 +324,55 @@ def shed(
     assert isinstance(source_code, str)
     assert isinstance(refactor, bool)
     assert isinstance(first_party_imports, frozenset)
-    assert all(isinstance(name, str) for name in first_party_imports)
-    assert all(name.isidentifier() for name in first_party_imports)
+    # Single pass over first_party_imports instead of one per check; this only
+    # runs on an lru_cache miss, but large frozensets are iterated just once.
+    assert all(
+        isinstance(name, str) and name.isidentifier() for name in first_party_imports
+    )
     assert min_version in _version_map.values()
 
     if source_code == "":
         return ""
+    if not source_code.strip():
+        # Whitespace-only sources always canonicalise to a single newline, so
+        # skip the pipeline (and the cache) entirely.  Empty-but-for-whitespace
+        # `__init__.py` files are common enough for this to be worthwhile.
+        return "\n"
+
+    # Check the persistent cache before doing any real work.  We only ever
+    # store results of complete runs, so a hit can short-circuit the whole
+    # pipeline; the syntax-error path below is never cached, and therefore
+    # warns afresh in each new process.
+    cache_path = None
+    cache_dir = _cache_dir()
+    if cache_dir is not None:
+        key = hashlib.blake2b(
+            repr(
+                (
+                    source_code,
+                    refactor,
+                    is_pyi,
+                    sorted(first_party_imports),
+                    min_version,
+                    _remove_unused_imports,
+                )
+            ).encode()
+        ).hexdigest()
+        cache_path = cache_dir / key
+        try:
+            return cache_path.read_text(encoding="utf-8")
+        except OSError:
+            pass
 
     # Use black to autodetect our target versions
     # TODO: we don't want to rely on black
-    target_versions = {k for k, v in _version_map.items() if v >= min_version}
     try:
-        parsed = lib2to3_parse(source_code.lstrip(), target_versions)
-        # black.InvalidInput, blib2to3.pgen2.tokenize.TokenError, SyntaxError...
-        # for forwards-compatibility I'm just going general here.
+        target_versions, min_version = _detect_versions(source_code, min_version)
+        # for forwards-compatibility the `except` clause is just going general here.
     except Exception as err:
         msg = f"Could not parse {_location}\n    {type(err).__qualname__}: {err}"
         for pattern, blocktype in _SUGGESTIONS:
-            if re.search(pattern, source_code, flags=re.MULTILINE):
+            if pattern.search(source_code):
                 msg += f"\n    Perhaps you should use a {blocktype!r} block instead?"
         try:
             compile(source_code, "<string>", "exec")
@@ -181,13 +390,6 @@ def shed(
         warnings.warn(w, stacklevel=_location.count(" block in ") + 2)
         return source_code
 
-    target_versions &= set(black.detect_target_versions(parsed))
-    assert target_versions
-    min_version = max(
-        min_version,
-        _version_map[min(target_versions, key=attrgetter("value"))],
-    )
-
     if refactor:
         # Here we have a deferred imports section, which is pretty ugly.
         # It does however have one crucial advantage: several hundred milliseconds
@@ -219,7 +421,7 @@ def shed(
     # Run black first to unlock `remove_pointless_parens_around_call` fixes.
     # Running it first  unfortunately breaks comment association for `split_assert_and`
     # and adds a trailing comma in imports in tests/recorded/issue75.txt
-    black_mode = black.Mode(target_versions=target_versions, is_pyi=is_pyi)
+    black_mode = _black_mode(target_versions, is_pyi)
     source_code = blackened = black.format_str(source_code, mode=black_mode)
 
     # ***Shed Codemods***
@@ -229,23 +431,8 @@ def shed(
         source_code = _run_codemods(source_code, min_version=min_version)
 
     # ***Ruff***
-    select = ",".join(_RUFF_RULES)
-    if _remove_unused_imports:
-        select += ",F401"
     source_code = subprocess.run(
-        [
-            "ruff",
-            "check",
-            f"--select={select}",
-            "--fix-only",
-            f"--target-version=py3{min_version[1]}",
-            "--isolated",  # ignore configuration files
-            "--exit-zero",  # Exit with 0, even upon detecting lint violations.
-            "--config=lint.isort.combine-as-imports=true",
-            f"--config=lint.isort.known-first-party={list(first_party_imports)}",
-            f"--config=lint.extend-safe-fixes={list(_RUFF_EXTEND_SAFE_FIXES)}",
-            "-",  # pass code on stdin
-        ],
+        _ruff_argv(min_version, first_party_imports, _remove_unused_imports),
         input=source_code,
         encoding="utf-8",
         check=True,
@@ -254,15 +441,20 @@ def shed(
 
     # ***Black***
     # Run formatter again last, if codemods/ruff did any changes, since they tend to
-    # leave dirty code
+    # leave dirty code.  This comparison replaced the old run-until-fixpoint loop:
+    # on already-canonical input (the dominant CI case) it is a single memcmp and
+    # the second black pass is skipped entirely.
     if source_code != blackened:
         source_code = black.format_str(source_code, mode=black_mode)
 
     # Remove any extra trailing whitespace
-    return source_code.rstrip() + "\n"
+    result = source_code.rstrip() + "\n"
+    if cache_path is not None:
+        _cache_store(cache_path, result)
+    return result
 
 
-@functools.lru_cache
+@functools.lru_cache(maxsize=128)
 def docshed(
     source: str,
     *,
@@ -275,9 +467,15 @@ def docshed(
     # Inspired by the blacken-docs package.
     assert isinstance(source, str)
     assert isinstance(first_party_imports, frozenset)
-    assert all(isinstance(name, str) for name in first_party_imports)
-    assert all(name.isidentifier() for name in first_party_imports)
+    assert all(
+        isinstance(name, str) and name.isidentifier() for name in first_party_imports
+    )
     assert min_version in _version_map.values()
+    if "```python" not in source and ".. " not in source:
+        # Neither pattern below can match without one of these markers, and
+        # a couple of C-level substring scans are much cheaper than running
+        # both block regexes over a document with no code blocks at all.
+        return source
     format_code = functools.partial(
         shed,
         refactor=refactor,
@@ -286,25 +484,6 @@ def docshed(
         _remove_unused_imports=False,
     )
 
-    markdown_pattern = re.compile(
-        r"(?P<before>^(?P<indent> *)```python\n)"
-        r"(?P<code>.*?)"
-        r"(?P<after>^(?P=indent)```\s*$)",
-        flags=re.DOTALL | re.MULTILINE,
-    )
-    rst_pattern = re.compile(
-        r"(?P<before>"
-        r"^(?P<indent> *)\.\. "
-        r"(?P<block>jupyter-execute::|"
-        r"invisible-code-block: python|"  # magic rst comment for Sybil doctests
-        r"(code|code-block|sourcecode|ipython):: (python|py|sage|python3|py3|numpy))\n"
-        r"((?P=indent) +:.*\n)*"
-        r"\n*"
-        r")"
-        r"(?P<code>(^((?P=indent) +.*)?\n)+)",
-        flags=re.MULTILINE,
-    )
-
     def _md_match(match: Match[str]) -> str:
         code = textwrap.dedent(match["code"])
         code = format_code(code, _location=f"```python markdown block in {_location}")
@@ -312,10 +491,17 @@ def docshed(
         return f'{match["before"]}{code}{match["after"]}'
 
     def _rst_match(match: Match[str]) -> str:
-        indent_pattern = re.compile("^ +(?=[^ ])", re.MULTILINE)
-        trailing_newline_pattern = re.compile(r"\n+\Z", re.MULTILINE)
-        min_indent = min(indent_pattern.findall(match["code"]))
-        trailing_ws_match = trailing_newline_pattern.search(match["code"])
+        # Track the shortest indent directly rather than materializing every
+        # indent string via findall() and min()-ing the list afterwards.
+        # These are all-space strings, so shortest == lexicographically least.
+        min_indent = ""
+        for indent_match in _indent_pattern.finditer(match["code"]):
+            indent = indent_match.group()
+            if not min_indent or len(indent) < len(min_indent):
+                min_indent = indent
+                if len(min_indent) == 1:
+                    break  # the pattern requires at least one space
+        trailing_ws_match = _trailing_newline_pattern.search(match["code"])
         assert trailing_ws_match
         trailing_ws = trailing_ws_match.group()
         code = textwrap.dedent(match["code"])
@@ -325,4 +511,4 @@ def docshed(
         code = textwrap.indent(code, min_indent)
         return f'{match["before"]}{code.rstrip()}{trailing_ws}'
 
-    return rst_pattern.sub(_rst_match, markdown_pattern.sub(_md_match, source))
+    return _rst_pattern.sub(_rst_match, _markdown_pattern.sub(_md_match, source))
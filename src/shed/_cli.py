@@ -5,18 +5,25 @@ pass the names of specific files to format instead.
 """
 
 import argparse
+import concurrent.futures
 import functools
+import hashlib
 import io
-import multiprocessing
+import json
 import os
+import re
+import stat
 import subprocess
 import sys
+import tempfile
 import tokenize
 import warnings
 from pathlib import Path
-from typing import Callable, FrozenSet, Optional, Union
+from typing import Callable, Dict, FrozenSet, List, Optional, Tuple, Union
 
-from . import ShedSyntaxWarning, _version_map, docshed, shed
+from black.parsing import lib2to3_parse
+
+from . import ShedSyntaxWarning, _cache_dir, _version_map, docshed, shed
 from ._is_python_file import is_python_file
 
 if sys.version_info[:2] > (3, 9):  # pragma: no cover
@@ -39,15 +46,33 @@ def _get_git_repo_root(cwd: Optional[str] = None) -> str:
     ).stdout.strip()
 
 
+_src_layout_pattern = re.compile(r"(?:^|/)src/([^/]+)/__init__\.py$")
+
+
 @functools.lru_cache
 def _guess_first_party_modules(cwd: Optional[str] = None) -> FrozenSet[str]:
     """Guess the name of the current package for first-party imports."""
     # Note: this fails inside git worktrees
     try:
         base = _get_git_repo_root(cwd)
+        # Scanning git's index is much cheaper than Path.glob, which walks
+        # the entire working tree including any virtualenvs and build dirs
+        # (and would happily report packages vendored inside them).
+        tracked = subprocess.run(
+            ["git", "ls-files", "-z"],
+            check=True,
+            timeout=10,
+            capture_output=True,
+            text=True,
+            cwd=base,
+        ).stdout
     except (subprocess.SubprocessError, FileNotFoundError):
         return frozenset()
-    provides = {init.parent.name for init in Path(base).glob("**/src/*/__init__.py")}
+    provides = {
+        match.group(1)
+        for match in map(_src_layout_pattern.search, tracked.split("\0"))
+        if match is not None
+    }
     return frozenset(
         p
         for p in {Path(base).name} | provides
@@ -61,7 +86,15 @@ def _guess_first_party_modules(cwd: Optional[str] = None) -> FrozenSet[str]:
 
 @functools.lru_cache(maxsize=None)
 def _should_format(fname: str) -> bool:
-    return fname.endswith((".md", ".rst", ".pyi")) or is_python_file(fname)
+    if fname.endswith((".md", ".rst", ".py", ".pyi")):
+        return True
+    if "." in os.path.basename(fname):
+        # Some other extension; don't open the file just to look for a
+        # shebang line it won't have.  That read is a syscall per tracked
+        # file on large repos, where non-Python files often outnumber
+        # Python files ten to one.
+        return False
+    return is_python_file(fname)
 
 
 def _rewrite_on_disk(
@@ -69,7 +102,14 @@ def _rewrite_on_disk(
 ) -> Union[bool, str]:
     """Return either bool(rewrote the file), or an error message string."""
     try:
-        with open(fname, mode="rb") as handle:
+        # O_NOATIME skips the access-time update on filesystems that would
+        # otherwise write one per read; it is owner-only, so retry without it.
+        flags = os.O_RDONLY | getattr(os, "O_NOATIME", 0)
+        try:
+            fd = os.open(fname, flags)
+        except PermissionError:  # pragma: no cover  # we own our test files
+            fd = os.open(fname, os.O_RDONLY)
+        with open(fd, mode="rb") as handle:
             bytes_on_disk = handle.read()
         encoding, _ = tokenize.detect_encoding(io.BytesIO(bytes_on_disk).readline)
         with io.TextIOWrapper(io.BytesIO(bytes_on_disk), encoding) as wrapper:
@@ -106,11 +146,91 @@ def _rewrite_on_disk(
             if not issubclass(w.category, ShedSyntaxWarning):
                 warnings.warn(w.message, category=w.category, stacklevel=2)
     if result != on_disk:
-        with open(fname, mode="w", encoding=encoding) as fh:
-            fh.write(result)
+        # Write to a sibling tempfile and atomically replace the original, so
+        # an interrupted run can never leave a truncated file behind.
+        out_fd, tmpname = tempfile.mkstemp(
+            dir=os.path.dirname(fname) or ".", prefix=os.path.basename(fname) + "."
+        )
+        try:
+            with open(out_fd, mode="w", encoding=encoding) as fh:
+                fh.write(result)
+            os.chmod(tmpname, stat.S_IMODE(os.stat(fname).st_mode))
+            os.replace(tmpname, fname)
+        except BaseException:  # pragma: no cover  # don't leave tempfiles behind
+            os.unlink(tmpname)
+            raise
     return msg or result != on_disk
 
 
+# Sidecar manifest which lets `cli()` skip files that have not changed since
+# the last clean run.  We record the stat signature of each file that was
+# processed without error; if it still matches on the next run we know the
+# file is already formatted, without even reading it.  The manifest is keyed
+# by the options that affect output, and lives in the version-keyed cache
+# directory so tool upgrades invalidate it along with everything else.
+_Manifest = Dict[str, List[int]]
+
+
+def _stat_tuple(fname: str) -> Optional[List[int]]:
+    """Return the [mtime_ns, size, inode] signature of fname, or None."""
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+def _manifest_path(
+    first_party_imports: FrozenSet[str],
+    refactor: bool,
+    min_version: Tuple[int, int],
+) -> Optional[Path]:
+    cache_dir = _cache_dir()
+    if cache_dir is None:  # pragma: no cover  # e.g. read-only home directory
+        return None
+    key = hashlib.blake2b(
+        repr((sorted(first_party_imports), refactor, min_version)).encode()
+    ).hexdigest()[:32]
+    return cache_dir / f"manifest-{key}.json"
+
+
+def _load_manifest(manifest_path: Optional[Path]) -> _Manifest:
+    if manifest_path is None:  # pragma: no cover
+        return {}
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(manifest, dict):
+        # Valid JSON but not ours; treat corruption like a missing manifest.
+        return {}
+    return manifest
+
+
+def _save_manifest(manifest_path: Optional[Path], manifest: _Manifest) -> None:
+    if manifest_path is None:  # pragma: no cover
+        return
+    try:
+        tmpname = manifest_path.with_name(f".{manifest_path.name}.tmp")
+        tmpname.write_text(json.dumps(manifest), encoding="utf-8")
+        os.replace(tmpname, manifest_path)
+    except OSError:  # pragma: no cover  # a cache failure should never be fatal
+        pass
+
+
+def _warm_imports(refactor: bool) -> None:  # pragma: no cover  # runs in workers
+    """Pay our deferred-import cost once per worker, not once per file.
+
+    The base dependencies are already imported by the time a worker is forked,
+    but the refactor-mode imports in `shed()` are deferred and would otherwise
+    be repeated in every worker on its first `--refactor` file.
+    """
+    if refactor:
+        import com2ann  # noqa: F401
+
+        from . import _codemods  # noqa: F401
+
+
 def cli() -> None:  # pragma: no cover  # mutates things in-place, will test later.
     """Execute the `shed` CLI."""
     # TODO: make this provide useful CLI help and usage hints
@@ -141,41 +261,90 @@ def cli() -> None:  # pragma: no cover  # mutates things in-place, will test lat
     if args.files:
         all_filenames = args.files
     else:
-        # Get all tracked files from `git ls-files`
+        # Get all tracked files from `git ls-files`.  We use NUL-terminated
+        # output so that unusual filenames survive, and split the whole buffer
+        # once rather than line-by-line.  We can't push the filtering into a
+        # git pathspec because extensionless scripts are only recognisable by
+        # their shebang line, so `_should_format` stays - but it only touches
+        # the disk for files without a known extension.
         try:
             root = os.path.relpath(_get_git_repo_root())
             all_filenames = subprocess.run(
-                ["git", "ls-files"],
+                ["git", "ls-files", "-z"],
                 check=True,
                 timeout=10,
                 stdout=subprocess.PIPE,
                 text=True,
                 cwd=root,
-            ).stdout.splitlines()
+            ).stdout.split("\0")
         except (subprocess.SubprocessError, FileNotFoundError):
             print("Doesn't seem to be a git repo; pass filenames to format.")  # noqa
             sys.exit(1)
         all_filenames = [
-            os.path.join(root, f) for f in all_filenames if _should_format(f)
+            os.path.join(root, f) for f in all_filenames if f and _should_format(f)
         ]
 
+    first_party_imports = _guess_first_party_modules()
     rewrite = functools.partial(
         _rewrite_on_disk,
-        first_party_imports=_guess_first_party_modules(),
+        first_party_imports=first_party_imports,
         refactor=args.refactor,
         min_version=args.min_version,
     )
 
+    # Skip anything whose stat signature matches the last clean run, and
+    # re-record the signature of everything we process without error below.
+    manifest_path = _manifest_path(first_party_imports, args.refactor, args.min_version)
+    manifest = _load_manifest(manifest_path)
+    all_filenames = [f for f in all_filenames if manifest.get(f) != _stat_tuple(f)]
+
+    def mark_clean(fname: str) -> None:
+        st = _stat_tuple(fname)
+        if st is not None:
+            manifest[fname] = st
+
     if len(all_filenames) > 4:
         # If we're formatting more than a few files, the improved throughput
-        # of a process pool probably covers the startup cost.
+        # of a process pool probably covers the startup cost.  Chunking the
+        # work amortizes the per-task dispatch overhead over many files.
+        #
+        # Note that file reads deliberately stay inside the workers rather
+        # than being batched in this parent process: each worker overlaps its
+        # own I/O with the CPU-bound formatting of its previous file, and
+        # shipping file contents through a queue would cost more in pickling
+        # than the batched reads could save.
+        ncpu = os.cpu_count() or 1
+        # Dispatch the largest files first: with chunked scheduling this
+        # approximates longest-task-first and stops one big file at the end
+        # of the queue from leaving every other worker idle.
+        all_filenames.sort(key=lambda f: (_stat_tuple(f) or [0, 0, 0])[1], reverse=True)
+        # Parse something trivial now so the blib2to3 grammar pickles are
+        # loaded in this parent process; forked workers then share the
+        # in-memory grammar via copy-on-write instead of each re-loading it
+        # on their first file.
+        lib2to3_parse("pass\n")
         try:
-            with multiprocessing.Pool() as pool:
-                for error_msg in pool.imap_unordered(rewrite, all_filenames):
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=ncpu,
+                initializer=_warm_imports,
+                initargs=(args.refactor,),
+            ) as executor:
+                results = executor.map(
+                    rewrite,
+                    all_filenames,
+                    chunksize=max(1, len(all_filenames) // (4 * ncpu)),
+                )
+                for fname, error_msg in zip(all_filenames, results):
                     if isinstance(error_msg, str):
                         print(error_msg)  # noqa
+                    else:
+                        mark_clean(fname)
+            _save_manifest(manifest_path, manifest)
             return
-        except BlockingIOError as err:  # pragma: no cover
+        except (
+            BlockingIOError,
+            concurrent.futures.process.BrokenProcessPool,
+        ) as err:  # pragma: no cover
             # This can occur when `os.fork()` fails due to limited available
             # memory or number-of-processes.  In this case, we fall back to
             # the slow path; and reprocess whatever we've already done for
@@ -186,3 +355,6 @@ def cli() -> None:  # pragma: no cover  # mutates things in-place, will test lat
         error_msg = rewrite(fname)
         if isinstance(error_msg, str):
             print(error_msg)  # noqa
+        else:
+            mark_clean(fname)
+    _save_manifest(manifest_path, manifest)
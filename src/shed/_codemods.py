@@ -6,7 +6,8 @@ nitpicks about typing unions and literals.
 """
 
 import re
-from ast import literal_eval
+from ast import literal_eval, parse
+from dataclasses import replace
 from functools import wraps
 from typing import List, Tuple, Union
 
@@ -78,7 +79,15 @@ def _run_codemods(code: str, min_version: Tuple[int, int]) -> str:
 
     if imports_hypothesis(code):  # pragma: no cover
         mod = attempt_hypothesis_codemods(context, mod)
-    mod = ShedFixers(context, min_version).transform_module(mod)
+    fixers = ShedFixers(context, min_version)
+    # `transform_module` would wrap the tree in a MetadataWrapper, which
+    # deep-copies it by default to guarantee no node has two parents.  `mod`
+    # is freshly parsed and never reused, so the copy is redundant - skipping
+    # it is the same trick usort uses, and saves a full tree traversal.
+    wrapper = cst.MetadataWrapper(mod, unsafe_skip_copy=True)
+    fixers.context = replace(context, wrapper=wrapper)
+    with fixers.resolve(wrapper):
+        mod = wrapper.module.visit(fixers)
     return mod.code
 
 
@@ -178,7 +187,9 @@ class ShedFixers(VisitorBasedCodemodCommand):
         # chain of attribute accesses ("fluent interface"), where we need the parens.
         noparens = updated_node.with_changes(lpar=[], rpar=[])
         try:
-            compile(self.module.code_for_node(noparens), "<string>", "eval")
+            # ast.parse stops after the parse phase, where compile() would
+            # also build a symbol table and emit bytecode we throw away.
+            parse(self.module.code_for_node(noparens), mode="eval")
             return noparens
         except SyntaxError:
             return updated_node
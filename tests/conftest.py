@@ -0,0 +1,16 @@
+"""Shared fixtures for the `shed` test suite."""
+
+import os
+
+import pytest
+
+
+@pytest.fixture(autouse=True, scope="session")
+def isolate_persistent_cache(tmp_path_factory):
+    """Point shed's persistent cache at a per-session temporary directory.
+
+    Without this, a full test run would populate the developer's real
+    ~/.cache/shed, and a second run would then be served from that cache -
+    skipping the formatting pipeline (and most of our coverage) entirely.
+    """
+    os.environ["XDG_CACHE_HOME"] = str(tmp_path_factory.mktemp("xdg-cache"))
@@ -16,7 +16,15 @@ from flake8_comprehensions import ComprehensionChecker
 from hypothesis import HealthCheck, example, given, reject, settings, strategies as st
 
 from shed import ShedSyntaxWarning, _default_min_version, _version_map, shed
-from shed._cli import _guess_first_party_modules, _rewrite_on_disk, _should_format
+from shed._cli import (
+    _guess_first_party_modules,
+    _load_manifest,
+    _manifest_path,
+    _rewrite_on_disk,
+    _save_manifest,
+    _should_format,
+    _stat_tuple,
+)
 
 TEYIT_TWO_PASS = """
 import unittest
@@ -152,12 +160,21 @@ def test_guesses_empty_for_non_repo_dirs():
         ("a.py", True),
         ("does not exist", False),
         ("a.pyi", True),
+        ("a.txt", False),
     ],
 )
 def test_should_format_autodetection(fname, should):
     assert _should_format(fname) == should
 
 
+def test_is_python_file_by_extension():
+    # `_should_format` short-circuits on the extension, so check the
+    # autoflake-derived helper's own fast path directly too.
+    from shed._is_python_file import is_python_file
+
+    assert is_python_file("a.py")
+
+
 @pytest.mark.parametrize(
     "fname,contents,changed",
     [
@@ -167,6 +184,8 @@ def test_should_format_autodetection(fname, should):
         ("a.pyi", "## Another comment\n", False),
         ("a.md", "```python\nprint(\n'hello world')\n```", True),
         ("a.rst", ".. code-block:: python\n\n    'single quotes'\n", True),
+        # Minimal one-space indent exercises the early exit in _rst_match
+        ("a.rst", ".. code-block:: python\n\n 'single quotes'\n", True),
         ("a.py", "print(\n'hello world')\n", True),
         ("a.py", 'f"{x=}"\n', False),
         ("from shebang", "#! python3\nprint(\n'hello world')\n", True),
@@ -205,6 +224,77 @@ def test_empty_stays_empty(refactor):
     assert shed(source_code="", refactor=refactor) == ""
 
 
+@pytest.mark.parametrize("source_code", [" ", "\n\n\n", " \t\r\x0c\n"])
+@pytest.mark.parametrize("refactor", [True, False])
+def test_whitespace_only_collapses_to_newline(source_code, refactor):
+    assert shed(source_code=source_code, refactor=refactor) == "\n"
+
+
+def test_manifest_roundtrip(monkeypatch, tmp_path):
+    from shed import _cache_dir
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    _cache_dir.cache_clear()
+    try:
+        f = tmp_path / "a.py"
+        f.write_text("pass\n")
+        assert _stat_tuple(str(f)) is not None
+        assert _stat_tuple(str(tmp_path / "nonexistent")) is None
+
+        manifest_path = _manifest_path(frozenset(), True, _default_min_version)
+        assert _load_manifest(manifest_path) == {}  # no manifest saved yet
+        manifest = {str(f): _stat_tuple(str(f))}
+        _save_manifest(manifest_path, manifest)
+        assert _load_manifest(manifest_path) == manifest
+
+        manifest_path.write_text("not valid json")
+        assert _load_manifest(manifest_path) == {}
+        manifest_path.write_text("[1, 2]")  # valid JSON, but not a dict
+        assert _load_manifest(manifest_path) == {}
+    finally:
+        _cache_dir.cache_clear()
+
+
+def test_cache_pruning(monkeypatch, tmp_path):
+    from shed import _cache_dir, _prune_cache
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    _cache_dir.cache_clear()
+    try:
+        stale_dir = tmp_path / "shed" / "old-tool-versions"
+        stale_dir.mkdir(parents=True)
+        cache_dir = _cache_dir()
+        assert cache_dir is not None
+        assert not stale_dir.exists()  # superseded version dirs are removed
+        for i in range(10):
+            (cache_dir / f"entry-{i}").write_text(f"result {i}\n")
+        _prune_cache(cache_dir, max_entries=4)
+        assert len(list(cache_dir.iterdir())) == 2  # aged out to max_entries / 2
+    finally:
+        _cache_dir.cache_clear()
+
+
+def test_persistent_cache_hit_across_processes(monkeypatch, tmp_path):
+    from shed import _cache_dir
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    _cache_dir.cache_clear()
+    try:
+        source_code = "print(\n'persistent cache')\n"
+        result = shed(source_code=source_code)
+        (entry,) = (tmp_path / "shed").glob("*/*")
+        # Clearing the in-process cache simulates a fresh CLI invocation,
+        # which should be served from the on-disk cache instead.
+        shed.cache_clear()
+        assert shed(source_code=source_code) == result == entry.read_text()
+        # And everything still works if no cache directory is available.
+        shed.cache_clear()
+        monkeypatch.setattr("shed._cache_dir", lambda: None)
+        assert shed(source_code=source_code) == result
+    finally:
+        _cache_dir.cache_clear()
+
+
 @pytest.mark.parametrize(
     "source_code,exception",
     [